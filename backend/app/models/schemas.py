@@ -19,10 +19,19 @@ class PipelineResult(BaseModel):
 
 class DatasetResponse(BaseModel):
     filename: str
-    rows: int
+    rows: Optional[int] = None # None until the background stats pass has counted them
     columns: int
     column_names: List[str]
     preview: List[Dict[str, Any]]
     distributions: Optional[Dict[str, Any]] = None 
     correlations: Optional[Dict[str, Any]] = None # New: {x_labels: [], y_labels: [], data: [[val, val], ...]}
     scatter_data: Optional[List[Dict[str, Any]]] = None # New: [{x: 1.2, y: 3.4, class: "Iris-setosa"}, ...]
+    dataset_id: Optional[str] = None # Content hash; key for /api/upload/{dataset_id}/viz
+    stats_ready: bool = True
+
+class DatasetStats(BaseModel):
+    ready: bool
+    rows: Optional[int] = None
+    distributions: Optional[Dict[str, Any]] = None
+    correlations: Optional[Dict[str, Any]] = None
+    scatter_data: Optional[List[Dict[str, Any]]] = None
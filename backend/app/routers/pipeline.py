@@ -1,131 +1,180 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
-from app.models.schemas import PipelineRequest, PipelineResult, DatasetResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, UploadFile, File, Request
+from fastapi.responses import FileResponse, JSONResponse
+from app.models.schemas import PipelineRequest, PipelineResult, DatasetResponse, DatasetStats
 from app.services.ml_service import process_pipeline
-import shutil
+from app.services.dataset_service import (
+    CACHE_DIR, cached_summary, compute_summary_in_background, mark_pending, preview_dataset,
+    store_upload, summary_status,
+)
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import hashlib
+import multiprocessing
 import os
-import pandas as pd
-import numpy as np
+import tempfile
 
 router = APIRouter()
 
 UPLOAD_DIR = "uploads"
 MODELS_DIR = "generated_models"
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(MODELS_DIR, exist_ok=True)
+
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 2 * 1024 ** 3))
+# Excel can't be streamed, so the whole sheet is parsed in memory (several x the file size)
+MAX_EXCEL_MEMORY_FRACTION = 0.5
+
+def new_process_pool():
+    # Pipeline runs are CPU-bound sklearn work; run them in worker processes so they
+    # don't contend for the API process's GIL. Spawn (not fork) because the API
+    # process already has threads running.
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+def _too_large_detail():
+    return f"File too large. Maximum upload size is {MAX_UPLOAD_BYTES // 1024 ** 2} MB."
+
+def _too_large():
+    return HTTPException(status_code=413, detail=_too_large_detail())
+
+async def reject_oversized_uploads(request: Request, call_next):
+    # Starlette spools the whole multipart body to disk before the handler runs, so the
+    # declared length is the only chance to refuse an upload before it is transferred.
+    if request.url.path == "/api/upload":
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": _too_large_detail()})
+    return await call_next(request)
+
+def _available_memory():
+    # MemAvailable counts reclaimable page cache; fall back to free pages elsewhere
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _save_upload(src, dst_path):
+    # Hash while copying so the content key costs no extra pass over the file
+    hasher = hashlib.blake2b(digest_size=16)
+    written = 0
+    with open(dst_path, "wb") as dst:
+        for block in iter(lambda: src.read(COPY_BUFFER_SIZE), b""):
+            written += len(block)
+            if written > MAX_UPLOAD_BYTES:
+                # Chunked bodies carry no Content-Length; stop before filling the disk
+                dst.close()
+                os.remove(dst_path)
+                raise _too_large()
+            hasher.update(block)
+            dst.write(block)
+    return hasher.hexdigest()
 
 @router.post("/api/upload", response_model=DatasetResponse)
-def upload_file(file: UploadFile = File(...)):
+def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     print(f"[{os.getpid()}] Starting upload for: {file.filename}")
     
     # Validate file extension
     if not file.filename.lower().endswith(('.csv', '.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="Invalid file format. Please upload CSV or Excel.")
 
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    # Stream into a temp file next to the cache; it is renamed to its content hash once
+    # the bytes are known, so a later upload under the same name can't rewrite it.
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".upload.tmp")
+    os.close(fd)
     
     try:
         # Save file to disk (Stream to avoid memory spike)
         print(f"[{os.getpid()}] Saving file to disk...")
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        print(f"[{os.getpid()}] File saved. Size: {os.path.getsize(file_path)} bytes")
-            
-        # Parse with Pandas (Memory Optimization: Load only necessary rows for preview first if large)
-        print(f"[{os.getpid()}] Reading dataframe...")
-        if file.filename.lower().endswith('.csv'):
-            # Check file size, if huge, warn or handle
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
-        
-        print(f"[{os.getpid()}] Dataframe loaded. Shape: {df.shape}")
+        digest = _save_upload(file.file, tmp_path)
+        file_size = os.path.getsize(tmp_path)
+        print(f"[{os.getpid()}] File saved. Size: {file_size} bytes, hash: {digest}")
 
-        # Extract Metadata
-        df_display = df.where(pd.notnull(df), None)
-        preview_data = df_display.head(5).to_dict(orient='records')
-        
-        # --- Visualizations Calculation (Limit memory usage) ---
-        distributions = {}
-        correlations = None
-        scatter_data = None
-        
-        if df.shape[1] > 0:
-            target_col = df.columns[-1]
-            try:
-                # Optimized Value Counts (Top 10)
-                val_counts = df[target_col].value_counts().head(10).to_dict()
-                val_counts = {str(k): int(v) for k, v in val_counts.items()}
-                distributions = {"target_column": target_col, "data": val_counts}
-            except Exception as e:
-                print(f"Dist calc error: {e}")
-            
-            # Select Numeric Columns
-            numeric_df = df.select_dtypes(include=[np.number])
+        if not file.filename.lower().endswith('.csv'):
+            available = _available_memory()
+            if available is not None and file_size > available * MAX_EXCEL_MEMORY_FRACTION:
+                # Never published, so /api/pipeline/run can't read_excel it later
+                raise HTTPException(status_code=413, detail="Excel file too large to load in memory. Please upload it as CSV, which is streamed.")
+        file_path = store_upload(tmp_path, file.filename, digest)
             
-            # 2. Correlations (Limit to first 1000 rows for speed/memory if large)
-            if numeric_df.shape[1] >= 2:
-                try:
-                    # Sampling for correlation if dataset is large to save memory
-                    if len(numeric_df) > 5000:
-                        corr_df = numeric_df.sample(n=5000, random_state=42)
-                    else:
-                        corr_df = numeric_df
-                    
-                    corr_matrix = corr_df.corr().round(2)
-                    correlations = {
-                        "labels": corr_matrix.columns.tolist(),
-                        "data": corr_matrix.values.tolist()
-                    }
-                except Exception as e:
-                    print(f"Corr calc error: {e}")
-            
-            # 3. Scatter Plot
-            if numeric_df.shape[1] >= 2:
-                try:
-                    col_x = numeric_df.columns[0]
-                    col_y = numeric_df.columns[1]
-                    
-                    # Sample max 300 points for performance
-                    sample_df = df.sample(n=min(300, len(df)), random_state=42)
-                    
-                    scatter_points = []
-                    for _, row in sample_df.iterrows():
-                        scatter_points.append({
-                            "x": float(row[col_x]) if pd.notnull(row[col_x]) else 0,
-                            "y": float(row[col_y]) if pd.notnull(row[col_y]) else 0,
-                            "class": str(row[target_col])
-                        })
-                        
-                    scatter_data = scatter_points
-                except Exception as e:
-                    print(f"Scatter calc error: {e}")
-
-        print(f"[{os.getpid()}] Calculations done. Returning response.")
-        return DatasetResponse(
-            filename=file.filename,
-            rows=df.shape[0],
-            columns=df.shape[1],
-            column_names=df.columns.tolist(),
-            preview=preview_data,
-            distributions=distributions,
-            correlations=correlations,
-            scatter_data=scatter_data
-        )
+        # Identical bytes were analysed before: return the full stats straight away
+        summary = cached_summary(digest)
+        if summary is not None:
+            print(f"[{os.getpid()}] Cache hit for {digest}. Returning cached stats.")
+            return DatasetResponse(filename=file.filename, dataset_id=digest, **summary)
+
+        # Otherwise answer from the first chunk only; the full pass (row count, charts,
+        # Parquet copy) runs after the response and is fetched from /api/upload/{id}/viz
+        preview = preview_dataset(file_path)
+        if mark_pending(digest):
+            background_tasks.add_task(compute_summary_in_background, file_path, digest)
+
+        print(f"[{os.getpid()}] Preview ready. Stats scheduled in background.")
+        return DatasetResponse(filename=file.filename, dataset_id=digest, stats_ready=False, rows=None, **preview)
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"CRITICAL UPLOAD ERROR: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Server Error: {str(e)}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@router.get("/api/upload/{dataset_id}/viz", response_model=DatasetStats)
+def upload_stats(dataset_id: str):
+    status, payload = summary_status(dataset_id)
+    if status == "ready":
+        return DatasetStats(
+            ready=True,
+            rows=payload["rows"],
+            distributions=payload["distributions"],
+            correlations=payload["correlations"],
+            scatter_data=payload["scatter_data"]
+        )
+    if status == "pending":
+        return DatasetStats(ready=False)
+    if status == "failed":
+        raise HTTPException(status_code=500, detail=f"Stats calculation failed: {payload}")
+    raise HTTPException(status_code=404, detail="Dataset not found")
 
 @router.post("/api/pipeline/run", response_model=PipelineResult)
-def run_pipeline_endpoint(pipeline: PipelineRequest):
-    return process_pipeline(pipeline)
+async def run_pipeline_endpoint(pipeline: PipelineRequest, request: Request):
+    # Falls back to the default thread pool when the app wasn't started with a process pool
+    pool = getattr(request.app.state, "pool", None)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, process_pipeline, pipeline)
+    except BrokenProcessPool as e:
+        # A worker died mid-run (typically OOM-killed) and the pool refuses all further
+        # work; swap in a fresh one so only this request fails.
+        if request.app.state.pool is pool:
+            request.app.state.pool = new_process_pool()
+            pool.shutdown(wait=False)
+        print(f"[{os.getpid()}] Pipeline worker crashed: {e}. Process pool restarted.")
+        return PipelineResult(
+            success=False,
+            message="Pipeline failed",
+            metrics={},
+            logs=["Critical Error: the training worker crashed, most likely out of memory. Try a smaller dataset."]
+        )
 
 @router.get("/api/download/{filename}")
 def download_model(filename: str):
     file_path = os.path.join(MODELS_DIR, filename)
     if os.path.exists(file_path):
-        return FileResponse(file_path, media_type='application/octet-stream', filename=filename)
+        # The pickle is already compressed; tell proxies not to gzip it again
+        return FileResponse(file_path, media_type='application/octet-stream', filename=filename,
+                            headers={"Content-Encoding": "identity"})
     raise HTTPException(status_code=404, detail="Model file not found")
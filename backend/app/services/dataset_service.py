@@ -0,0 +1,567 @@
+import os
+import re
+import json
+import shutil
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from scipy.linalg.blas import dsyrk
+
+UPLOAD_DIR = "uploads"
+CACHE_DIR = os.path.join(UPLOAD_DIR, ".cache")
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+CSV_CHUNK_SIZE = 100_000
+CSV_BLOCK_SIZE = 8 << 20
+SCATTER_SAMPLE_SIZE = 300
+TOP_CLASSES = 10
+
+# The per-chunk accumulators touch disjoint columns and spend most of their time in
+# pandas/numpy kernels that release the GIL, so they can run side by side.
+_STATS_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix="upload-stats")
+
+
+def _csv_options():
+    read_options = pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE, use_threads=True)
+    # Match pd.read_csv: empty strings are missing values, dates stay as text (see _arrow_to_pandas)
+    convert_options = pacsv.ConvertOptions(strings_can_be_null=True, timestamp_parsers=[])
+    return read_options, convert_options
+
+
+def _arrow_to_pandas(data):
+    # Arrow infers date/time columns that pd.read_csv leaves as strings; cast them back
+    # so preprocessing sees the same dtypes whichever reader produced the frame.
+    for i, field in enumerate(data.schema):
+        if pa.types.is_temporal(field.type):
+            data = data.set_column(i, field.name, pc.cast(data.column(i), pa.string()))
+    return data.to_pandas(self_destruct=True)
+
+
+def read_csv(file_path):
+    # pyarrow parses blocks on a thread pool with vectorized number conversion
+    read_options, convert_options = _csv_options()
+    try:
+        table = pacsv.read_csv(file_path, read_options=read_options, convert_options=convert_options)
+    except pa.ArrowInvalid as e:
+        print(f"Arrow CSV reader failed ({e}); falling back to pandas")
+        return pd.read_csv(file_path)
+    return _arrow_to_pandas(table)
+
+
+def iter_chunks(file_path, engine="arrow"):
+    # CSVs are streamed so peak memory stays at one chunk; Excel has no chunked reader.
+    if not file_path.lower().endswith('.csv'):
+        yield pd.read_excel(file_path)
+    elif engine == "arrow":
+        read_options, convert_options = _csv_options()
+        with pacsv.open_csv(file_path, read_options=read_options, convert_options=convert_options) as reader:
+            empty = True
+            for batch in reader:
+                empty = False
+                yield _arrow_to_pandas(batch)
+            if empty:
+                # Header-only file: no batches, but pd.read_csv still reports the columns
+                yield _arrow_to_pandas(reader.schema.empty_table())
+    else:
+        with pd.read_csv(file_path, chunksize=CSV_CHUNK_SIZE, low_memory=True) as reader:
+            yield from reader
+
+
+def _numeric_block(chunk, columns):
+    # Later chunks may infer a different dtype for the same column; coerce so the
+    # accumulators always see floats.
+    block = chunk[columns]
+    if not all(pd.api.types.is_numeric_dtype(t) for t in block.dtypes):
+        block = block.apply(pd.to_numeric, errors='coerce')
+    return block.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _label(value):
+    # An int column comes out as float64 in any chunk that has a null; print 2.0 as "2"
+    # so the same class isn't split across two keys.
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class TargetDistribution:
+    """Running value counts of the target column."""
+
+    def __init__(self, target_col):
+        self.target_col = target_col
+        self.counts = Counter()
+
+    def update(self, chunk):
+        col = chunk[self.target_col]
+        if pd.api.types.is_numeric_dtype(col) or pd.api.types.is_bool_dtype(col):
+            # Numeric labels: np.unique's sort on the raw ndarray beats building a hash table
+            if col.hasnans:
+                col = col.dropna()
+            vals, cnts = np.unique(col.to_numpy(), return_counts=True)
+        else:
+            # String labels: value_counts hashes the objects directly, no fixed-width copy
+            counts = col.value_counts(dropna=True)
+            vals, cnts = counts.index, counts.to_numpy()
+        self.counts.update(dict(zip(map(_label, vals.tolist()), cnts.tolist())))
+
+    def result(self):
+        k = min(TOP_CLASSES, len(self.counts))
+        if k == 0:
+            return {}
+        labels = list(self.counts.keys())
+        counts = np.fromiter(self.counts.values(), dtype=np.int64, count=len(labels))
+        # Partial sort: O(n) selection of the top k, then order just those k
+        top = np.argpartition(-counts, k - 1)[:k]
+        top = top[np.argsort(-counts[top], kind='stable')]
+        return {labels[i]: int(counts[i]) for i in top}
+
+
+def _syrk_update(c, x):
+    # c[upper] += x.T @ x via BLAS syrk: half the flops of a general matmul since the
+    # product is symmetric. Passing x.T for C-ordered x avoids a transpose copy.
+    if x.flags.f_contiguous:
+        dsyrk(1.0, x, beta=1.0, c=c, trans=1, lower=0, overwrite_c=1)
+    else:
+        dsyrk(1.0, x.T, beta=1.0, c=c, trans=0, lower=0, overwrite_c=1)
+
+
+def _mirror_upper(u):
+    return np.triu(u) + np.triu(u, 1).T
+
+
+class StreamingCorrelation:
+    """Pairwise-complete Pearson correlation (same semantics as DataFrame.corr) from running sums."""
+
+    def __init__(self, columns):
+        d = len(columns)
+        self.columns = list(columns)
+        self.shift = None
+        # n and sum_xy are symmetric: only their upper triangle is accumulated (Fortran
+        # order so BLAS syrk can update them in place) and result() mirrors it.
+        self.n = np.zeros((d, d), order='F')
+        self.sum_x = np.zeros((d, d))
+        self.sumsq_x = np.zeros((d, d))
+        self.sum_xy = np.zeros((d, d), order='F')
+
+    def update(self, chunk):
+        x = _numeric_block(chunk, self.columns)
+        mask = ~np.isnan(x)
+        if self.shift is None:
+            # Shifting by the first chunk's means keeps the raw-moment formula numerically stable
+            self.shift = np.where(mask, x, 0.0).sum(axis=0) / np.maximum(mask.sum(axis=0), 1)
+        if mask.all():
+            # Dense chunk: every pair sees every row, so the mask products collapse to
+            # column sums broadcast along j and we skip three of the four d x d matmuls.
+            x = x - self.shift
+            self.n += len(x)
+            self.sum_x += x.sum(axis=0)[:, None]
+            self.sumsq_x += (x * x).sum(axis=0)[:, None]
+            _syrk_update(self.sum_xy, x)
+            return
+        x = np.where(mask, x - self.shift, 0.0)
+        m = mask.astype(np.float64)
+        # [i, j] entries only count rows where both column i and column j are present
+        _syrk_update(self.n, m)
+        self.sum_x += x.T @ m
+        self.sumsq_x += (x * x).T @ m
+        _syrk_update(self.sum_xy, x)
+
+    def result(self):
+        n = _mirror_upper(self.n)
+        sum_xy = _mirror_upper(self.sum_xy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if np.all(n == n[0, 0]):
+                # No missing values anywhere: corrcoef-style in-place normalization of the
+                # covariance, no extra d x d temporaries.
+                c = sum_xy
+                c -= np.outer(self.sum_x[:, 0], self.sum_x[:, 0]) / n[0, 0]
+                d = 1.0 / np.sqrt(np.diag(c))
+                c *= d
+                c *= d[:, None]
+            else:
+                sum_x, sumsq_x = self.sum_x, self.sumsq_x
+                c = sum_xy
+                c *= n
+                c -= sum_x * sum_x.T
+                var_x = n * sumsq_x
+                var_x -= sum_x ** 2
+                var_x *= var_x.T
+                np.sqrt(var_x, out=var_x)
+                c /= var_x
+        # Constant / empty columns have no defined correlation; report 0 so the payload stays JSON-safe
+        np.nan_to_num(c, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        np.clip(c, -1.0, 1.0, out=c)
+        return np.round(c, 2, out=c)
+
+
+class ScatterReservoir:
+    """Uniform sample of (x, y, class) points over a stream of chunks (Algorithm L)."""
+
+    def __init__(self, col_x, col_y, target_col, size=SCATTER_SAMPLE_SIZE, seed=42):
+        self.cols = [col_x, col_y, target_col]
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.xs = np.empty(size)
+        self.ys = np.empty(size)
+        self.cs = np.empty(size, dtype=object)
+        self.filled = 0
+        self.seen = 0
+        self.w = 1.0
+        self.next_index = None
+
+    def _skip(self):
+        # Jump straight to the stream index of the next row that enters the reservoir,
+        # so rows in between are never touched.
+        self.w *= np.exp(np.log(self.rng.random()) / self.size)
+        self.next_index += int(np.log(self.rng.random()) // np.log1p(-self.w)) + 1
+
+    def update(self, chunk):
+        positions, slots = [], []
+        if self.filled < self.size:
+            take = min(self.size - self.filled, len(chunk))
+            positions.extend(range(take))
+            slots.extend(range(self.filled, self.filled + take))
+            self.filled += take
+            if self.filled == self.size:
+                self.next_index = self.seen + take - 1
+                self._skip()
+
+        end = self.seen + len(chunk)
+        while self.next_index is not None and self.next_index < end:
+            positions.append(self.next_index - self.seen)
+            slots.append(int(self.rng.integers(self.size)))
+            self._skip()
+        self.seen = end
+        if not positions:
+            return
+
+        # Only the selected rows are converted. When a slot is hit twice the later row wins.
+        slots, last = np.unique(np.asarray(slots)[::-1], return_index=True)
+        rows = chunk.iloc[np.asarray(positions)[::-1][last]]
+        col_x, col_y, target_col = self.cols
+        self.xs[slots] = _numeric_block(rows, [col_x])[:, 0]
+        self.ys[slots] = _numeric_block(rows, [col_y])[:, 0]
+        self.cs[slots] = [_label(v) for v in rows[target_col].tolist()]
+
+    def points(self):
+        n = self.filled
+        return self.xs[:n], self.ys[:n], self.cs[:n]
+
+
+class ParquetSink:
+    """Appends each chunk to a Parquet file so pipelines can skip CSV parsing entirely."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.writer = None
+        self.failed = False
+
+    def update(self, chunk):
+        if self.failed:
+            return
+        try:
+            if self.writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self.writer = pq.ParquetWriter(self.tmp_path, table.schema, compression='snappy')
+            else:
+                # Later chunks are cast to the first chunk's schema; a column whose inferred
+                # type drifts incompatibly abandons the file and load_dataset falls back to CSV.
+                table = pa.Table.from_pandas(chunk, schema=self.writer.schema, preserve_index=False)
+            self.writer.write_table(table)
+        except Exception as e:
+            print(f"Parquet write error: {e}")
+            self.failed = True
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.failed or not os.path.exists(self.tmp_path):
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+            return
+        os.replace(self.tmp_path, self.path)
+
+
+def _preview_rows(chunk):
+    # Slice before replacing NaN so only the 5 preview rows are copied; object
+    # dtype keeps float columns from turning the None back into NaN.
+    head = chunk.head(5).astype(object)
+    return head.where(pd.notnull(head), None).to_dict(orient='records')
+
+
+def _preview_payload(first):
+    return {
+        "columns": first.shape[1],
+        "column_names": first.columns.tolist(),
+        "preview": _preview_rows(first),
+    }
+
+
+def preview_dataset(file_path):
+    if not file_path.lower().endswith('.csv'):
+        # iter_chunks would load the whole workbook; the preview only needs the head
+        return _preview_payload(pd.read_excel(file_path, nrows=5))
+
+    # Parse just the first chunk: enough for the column list and preview table
+    try:
+        chunks = iter_chunks(file_path)
+        first = next(chunks, None)
+    except pa.ArrowInvalid:
+        chunks = iter_chunks(file_path, engine="pandas")
+        first = next(chunks, None)
+    chunks.close()
+    if first is None:
+        return {"columns": 0, "column_names": [], "preview": []}
+    return _preview_payload(first)
+
+
+def summarize_dataset(file_path, parquet_path=None, engine="arrow"):
+    rows = 0
+    column_names = []
+    preview_data = []
+    target_col = None
+    accumulators = {}
+    sink = ParquetSink(parquet_path) if parquet_path else None
+
+    try:
+        for chunk in iter_chunks(file_path, engine):
+            if target_col is None:
+                print(f"[{os.getpid()}] First chunk parsed. Columns: {chunk.shape[1]}")
+                column_names = chunk.columns.tolist()
+                preview_data = _preview_rows(chunk)
+                if chunk.shape[1] == 0:
+                    break
+
+                target_col = chunk.columns[-1]
+                accumulators["Dist"] = TargetDistribution(target_col)
+                numeric_cols = chunk.select_dtypes(include=[np.number]).columns
+                if len(numeric_cols) >= 2:
+                    accumulators["Corr"] = StreamingCorrelation(numeric_cols)
+                    accumulators["Scatter"] = ScatterReservoir(numeric_cols[0], numeric_cols[1], target_col)
+
+            rows += len(chunk)
+
+            # Distribution, correlation and scatter sampling run concurrently on this chunk
+            futures = {name: _STATS_POOL.submit(acc.update, chunk) for name, acc in accumulators.items()}
+            if sink is not None:
+                sink.update(chunk)
+            for name, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"{name} calc error: {e}")
+                    del accumulators[name]
+    except pa.ArrowInvalid as e:
+        # The streaming reader fixes column types from the first block; a later block
+        # that doesn't fit them aborts the stream, so start over with pandas' reader.
+        print(f"Arrow CSV stream failed ({e}); retrying with pandas")
+        if sink is not None:
+            sink.failed = True
+            sink.close()
+        return summarize_dataset(file_path, parquet_path, engine="pandas")
+
+    if sink is not None:
+        sink.close()
+    print(f"[{os.getpid()}] Dataset streamed. Rows: {rows}")
+
+    # --- Finalize Visualizations ---
+    distributions = {}
+    correlations = None
+    scatter_data = None
+
+    if "Dist" in accumulators:
+        distributions = {"target_column": target_col, "data": accumulators["Dist"].result()}
+
+    if "Corr" in accumulators:
+        try:
+            corr_acc = accumulators["Corr"]
+            correlations = {
+                "labels": corr_acc.columns,
+                "data": corr_acc.result().tolist()
+            }
+        except Exception as e:
+            print(f"Corr calc error: {e}")
+
+    scatter_acc = accumulators.get("Scatter")
+    if scatter_acc is not None and scatter_acc.filled:
+        try:
+            xs, ys, cs = scatter_acc.points()
+            xs = np.nan_to_num(xs, nan=0.0)
+            ys = np.nan_to_num(ys, nan=0.0)
+            scatter_data = [
+                {"x": x, "y": y, "class": c}
+                for x, y, c in zip(xs.tolist(), ys.tolist(), cs.tolist())
+            ]
+        except Exception as e:
+            print(f"Scatter calc error: {e}")
+
+    return {
+        "rows": rows,
+        "columns": len(column_names),
+        "column_names": column_names,
+        "preview": preview_data,
+        "distributions": distributions,
+        "correlations": correlations,
+        "scatter_data": scatter_data,
+    }
+
+
+# === Content-addressed cache ===
+# Uploads are keyed by a hash of their bytes: the raw file is stored as {hash}.<ext>, the
+# visualization payload as {hash}.json and the parsed DataFrame as {hash}.parquet, so
+# re-uploading the same file or running pipelines against it skips CSV parsing.
+# {filename}.ref maps a dataset name to the hash of its latest upload. Files under a
+# hash never change, so a background pass can't pick up bytes from a later upload.
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _parquet_path(digest):
+    return os.path.join(CACHE_DIR, f"{digest}.parquet")
+
+
+def source_path(digest, filename):
+    # Keep the extension: readers pick CSV vs Excel from it
+    return os.path.join(CACHE_DIR, digest + os.path.splitext(filename)[1].lower())
+
+
+def remember_upload(filename, digest):
+    def write(path):
+        with open(path, "w") as f:
+            f.write(digest)
+    _write_atomic(os.path.join(CACHE_DIR, f"{filename}.ref"), write)
+
+
+def store_upload(tmp_path, filename, digest):
+    src_path = source_path(digest, filename)
+    if os.path.exists(src_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, src_path)
+
+    # Publish under the dataset name as a hard link; replacing the link later leaves
+    # the content-addressed copy untouched.
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    link_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        os.link(src_path, link_path)
+    except OSError:
+        shutil.copyfile(src_path, link_path)
+    os.replace(link_path, file_path)
+    remember_upload(filename, digest)
+    return src_path
+
+
+def _digest_for(filename):
+    ref_path = os.path.join(CACHE_DIR, f"{filename}.ref")
+    if not os.path.exists(ref_path):
+        return None
+    with open(ref_path) as f:
+        return f.read().strip() or None
+
+
+def cached_summary(digest):
+    cache_path = os.path.join(CACHE_DIR, f"{digest}.json")
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def get_dataset_summary(file_path, digest):
+    summary = cached_summary(digest)
+    if summary is not None:
+        print(f"[{os.getpid()}] Cache hit for {digest}. Skipping parse.")
+        return summary
+
+    print(f"[{os.getpid()}] Streaming dataframe...")
+    summary = summarize_dataset(file_path, parquet_path=_parquet_path(digest))
+    try:
+        def write(path):
+            with open(path, "w") as f:
+                json.dump(summary, f, default=str)
+        _write_atomic(os.path.join(CACHE_DIR, f"{digest}.json"), write)
+    except Exception as e:
+        print(f"Summary cache write error: {e}")
+    return summary
+
+
+# === Background summaries ===
+# Uploads return after parsing the first chunk; the full pass runs as a background task
+# and the client polls summary_status until the cached JSON appears.
+_pending = set()
+_failed = {}
+_status_lock = threading.Lock()
+
+
+def mark_pending(digest):
+    with _status_lock:
+        if digest in _pending:
+            return False
+        _pending.add(digest)
+        _failed.pop(digest, None)
+        return True
+
+
+def compute_summary_in_background(file_path, digest):
+    try:
+        get_dataset_summary(file_path, digest)
+    except Exception as e:
+        traceback.print_exc()
+        with _status_lock:
+            _failed[digest] = str(e)
+    finally:
+        with _status_lock:
+            _pending.discard(digest)
+
+
+def summary_status(digest):
+    if not re.fullmatch(r"[0-9a-f]{32}", digest):
+        return "unknown", None
+    summary = cached_summary(digest)
+    if summary is not None:
+        return "ready", summary
+    with _status_lock:
+        if digest in _pending:
+            return "pending", None
+        if digest in _failed:
+            return "failed", _failed[digest]
+    return "unknown", None
+
+
+def load_dataset(filename):
+    digest = _digest_for(filename)
+    parquet_path = _parquet_path(digest) if digest else None
+    file_path = source_path(digest, filename) if digest else None
+    if file_path is None or not os.path.exists(file_path):
+        file_path = os.path.join(UPLOAD_DIR, filename)
+
+    if parquet_path and os.path.exists(parquet_path):
+        print(f"[{os.getpid()}] Loading columnar copy of '{filename}'")
+        return pd.read_parquet(parquet_path, engine='pyarrow')
+
+    if file_path.lower().endswith('.csv'):
+        df = read_csv(file_path)
+    else:
+        df = pd.read_excel(file_path)
+
+    if parquet_path:
+        # Upload-time write was skipped or abandoned: memoize this parse for the next run
+        try:
+            _write_atomic(parquet_path, lambda path: df.to_parquet(path, engine='pyarrow', compression='snappy', index=False))
+        except Exception as e:
+            print(f"Parquet cache write error: {e}")
+    return df
@@ -4,18 +4,37 @@ import numpy as np
 import time
 import joblib
 from datetime import datetime
-from sklearn.preprocessing import StandardScaler, MinMaxScaler, LabelEncoder
+from sklearn.preprocessing import StandardScaler, MinMaxScaler, LabelEncoder, OneHotEncoder, OrdinalEncoder
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split
+from sklearn.inspection import permutation_importance
 from sklearn.metrics import accuracy_score, confusion_matrix
 from app.models.schemas import PipelineRequest, PipelineResult, PipelineStep
+from app.services.dataset_service import load_dataset
 
 UPLOAD_DIR = "uploads"
 MODELS_DIR = "generated_models"
 
-if not os.path.exists(MODELS_DIR):
-    os.makedirs(MODELS_DIR)
+os.makedirs(MODELS_DIR, exist_ok=True)
+
+MODEL_TYPES = ["logistic_regression", "decision_tree_classifier", "hist_gradient_boosting"]
+
+# lz4 compresses model files several-fold at near-memcpy speed; zlib is the stdlib fallback
+try:
+    import lz4.frame  # noqa: F401
+    MODEL_COMPRESSION = ('lz4', 3)
+except ImportError:
+    MODEL_COMPRESSION = ('zlib', 3)
+
+# Above this many encoded features LogisticRegression switches from lbfgs to saga
+LARGE_FEATURES = 100
+
+# Row cap for permutation importance on models without built-in importances
+PERMUTATION_MAX_SAMPLES = 10_000
 
 STEP_TEMPLATES = {
   "standard_scaler": { "label": "Standard Scaler" },
@@ -23,9 +42,20 @@ STEP_TEMPLATES = {
   "drop_nulls": { "label": "Drop Missing Values" },
   "logistic_regression": { "label": "Logistic Regression" },
   "decision_tree_classifier": { "label": "Decision Tree Classifier" },
+  "hist_gradient_boosting": { "label": "Histogram Gradient Boosting" },
   "train_test_split": {"label": "Train/Test Split"} 
 }
 
+def downcast_numeric(df, numeric_cols):
+    # float32 / narrow ints halve the bytes the scalers, BLAS and tree builders stream through
+    dtypes = {}
+    for c in numeric_cols:
+        if df[c].dtype == np.float64:
+            dtypes[c] = np.float32
+        elif df[c].dtype == np.int64:
+            dtypes[c] = pd.to_numeric(df[c], downcast='integer').dtype
+    return df.astype(dtypes) if dtypes else df
+
 def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
     logs = []
     try:
@@ -41,51 +71,56 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
             )
             
         logs.append(f"Loading dataset '{pipeline.datasetName}'...")
-        if dataset_path.lower().endswith('.csv'):
-             df = pd.read_csv(dataset_path)
-        else:
-             df = pd.read_excel(dataset_path)
+        df = load_dataset(pipeline.datasetName)
         
         logs.append(f"Initial shape: {df.shape}")
+        # Partition columns by dtype once; later steps reuse these lists instead of rescanning
+        numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+        categorical_cols = df.select_dtypes(include=['object', 'category']).columns.tolist()
+        bool_cols = df.select_dtypes(include=['bool']).columns.tolist()
+
+        mem_before = df.memory_usage(deep=False).sum()
+        df = downcast_numeric(df, numeric_cols)
+        mem_after = df.memory_usage(deep=False).sum()
+        logs.append(f"Downcast numeric columns: {mem_before / 1e6:.1f} MB -> {mem_after / 1e6:.1f} MB")
 
         test_size = 0.2
         model_artifact = None
+        scalers = []
         
         # === Preprocessing ===
+        # Drops reshape the data (and the target) so they run eagerly; scalers are collected
+        # into the sklearn Pipeline built below and fit once, on the training split only.
         for step in pipeline.steps:
             if step.type == "drop_nulls":
                 logs.append("Applying Drop Missing Values...")
                 shape_before = df.shape
                 axis = step.params.get("axis", 0)
                 df = df.dropna(axis=axis)
+                if df.shape[1] != shape_before[1]:
+                    remaining = set(df.columns)
+                    numeric_cols = [c for c in numeric_cols if c in remaining]
+                    categorical_cols = [c for c in categorical_cols if c in remaining]
+                    bool_cols = [c for c in bool_cols if c in remaining]
                 logs.append(f"Dropped rows/cols. Shape: {shape_before} -> {df.shape}")
                 
             elif step.type == "standard_scaler":
-                logs.append("Applying Standard Scaler...")
-                numeric_cols = df.select_dtypes(include=[np.number]).columns
-                if len(numeric_cols) > 0:
-                    scaler = StandardScaler()
-                    df[numeric_cols] = scaler.fit_transform(df[numeric_cols])
-                    logs.append(f"Scaled {len(numeric_cols)} numeric columns.")
-                else:
-                    logs.append("Warning: No numeric columns to scale.")
+                logs.append("Adding Standard Scaler...")
+                scalers.append((f"standard_scaler_{len(scalers)}", StandardScaler()))
 
             elif step.type == "min_max_scaler":
-                logs.append("Applying MinMax Scaler...")
-                numeric_cols = df.select_dtypes(include=[np.number]).columns
-                if len(numeric_cols) > 0:
-                    feature_range = step.params.get("feature_range", "0,1")
-                    try:
-                        fr = tuple(map(int, feature_range.split(',')))
-                        scaler = MinMaxScaler(feature_range=fr)
-                        df[numeric_cols] = scaler.fit_transform(df[numeric_cols])
-                        logs.append(f"Scaled {len(numeric_cols)} numeric columns to range {fr}.")
-                    except:
-                         logs.append("Error parsing feature_range, using default (0, 1).")
-                         scaler = MinMaxScaler()
-                         df[numeric_cols] = scaler.fit_transform(df[numeric_cols])
-                else:
-                    logs.append("Warning: No numeric columns to scale.")
+                logs.append("Adding MinMax Scaler...")
+                feature_range = step.params.get("feature_range", "0,1")
+                try:
+                    fr = tuple(map(int, feature_range.split(',')))
+                    if len(fr) != 2 or fr[0] >= fr[1]:
+                        raise ValueError(f"invalid feature_range {feature_range}")
+                    scaler = MinMaxScaler(feature_range=fr)
+                    logs.append(f"Numeric columns will be scaled to range {fr}.")
+                except:
+                     logs.append("Error parsing feature_range, using default (0, 1).")
+                     scaler = MinMaxScaler()
+                scalers.append((f"min_max_scaler_{len(scalers)}", scaler))
             
             elif step.type == "train_test_split":
                 ts = step.params.get("test_size", 0.2)
@@ -93,7 +128,7 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
                 test_size = float(ts)
 
         # === Model Training ===
-        model_step = next((s for s in pipeline.steps if s.type in ["logistic_regression", "decision_tree_classifier"]), None)
+        model_step = next((s for s in pipeline.steps if s.type in MODEL_TYPES), None)
         
         metrics = {}
         saved_model_filename = None
@@ -106,24 +141,48 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
             y = df.iloc[:, -1]
             X_df = df.iloc[:, :-1]
             
-            # Feature Encoding (One-Hot for Categorical Features) - Simple implementation
-            # Identify object columns in features
-            X_categorical = X_df.select_dtypes(include=['object', 'category']).columns
-            X_numeric = X_df.select_dtypes(include=[np.number]).columns
-            
-            if len(X_categorical) > 0:
-                logs.append(f"One-Hot Encoding categorical features: {list(X_categorical)}")
-                X = pd.get_dummies(X_df, columns=X_categorical, drop_first=True)
-            else:
-                X = X_df.select_dtypes(include=[np.number])
+            # The ColumnTransformer routes each feature group (target excluded)
+            X_categorical = [c for c in categorical_cols if c != target_col_name]
+            X_numeric = [c for c in numeric_cols if c != target_col_name]
+            X_bool = [c for c in bool_cols if c != target_col_name]
+
+            transformers = []
+            if len(X_numeric) > 0:
+                transformers.append(("num", Pipeline(scalers) if scalers else "passthrough", X_numeric))
+                if scalers:
+                    logs.append(f"Scaling {len(X_numeric)} numeric columns ({len(scalers)} scaler step(s)).")
+            elif scalers:
+                logs.append("Warning: No numeric columns to scale.")
+            if len(X_categorical) > 0 and model_step.type == "hist_gradient_boosting":
+                # HGB needs dense input but splits categories natively, so ordinal codes
+                # (rare levels pooled to fit its 255 bins) replace the one-hot block.
+                logs.append(f"Ordinal Encoding categorical features: {X_categorical}")
+                encoder = OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=np.nan,
+                                         max_categories=255, dtype=np.float32)
+                transformers.append(("cat", encoder, X_categorical))
+            elif len(X_categorical) > 0:
+                logs.append(f"One-Hot Encoding categorical features: {X_categorical}")
+                # Sparse CSR: one-hot blocks are mostly zeros and logistic regression has a
+                # sparse-aware fit path (the decision tree densifies, see below).
+                encoder = OneHotEncoder(drop='first', sparse_output=True, handle_unknown='ignore', dtype=np.float32)
+                transformers.append(("cat", encoder, X_categorical))
+            if len(X_bool) > 0:
+                # Already 0/1 features: used as-is, never scaled. Appended last so the
+                # categorical indices passed to HGB stay put.
+                transformers.append(("bool", "passthrough", X_bool))
 
             logs.append(f"Target Column: {target_col_name}")
-            logs.append(f"Feature Columns (Post-Encoding): {list(X.columns)}")
             
-            if X.shape[1] == 0:
+            if not transformers:
                  logs.append("Error: No numeric feature columns found/generated.")
                  return PipelineResult(success=False, message="Training failed", metrics={}, logs=logs)
 
+            # sparse_threshold=1.0 keeps the output CSR whenever the one-hot block is present.
+            # Decision trees only route missing values on dense input, so they get a dense matrix.
+            sparse_threshold = 0.0 if model_step.type == "decision_tree_classifier" else 1.0
+            preprocess = ColumnTransformer(transformers, sparse_threshold=sparse_threshold, verbose_feature_names_out=False)
+            X = X_df[X_numeric + X_categorical + X_bool]
+
             # Target Encoding
             if y.dtype == 'object' or y.dtype.name == 'category' or isinstance(df.iloc[0, -1], str):
                  le = LabelEncoder()
@@ -136,26 +195,48 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
             logs.append(f"Train Set: {X_train.shape[0]} samples")
             logs.append(f"Test Set: {X_test.shape[0]} samples")
 
+            logs.append("Training model...")
+            # Fit the transformer on its own first so the solver choice sees the encoded width
+            X_train_t = preprocess.fit_transform(X_train, y_train)
+            n_features = X_train_t.shape[1]
+
             model = None
             if model_step.type == "logistic_regression":
                 C_val = model_step.params.get("C", 1.0)
-                model = LogisticRegression(C=float(C_val), random_state=42, max_iter=1000)
+                # saga only pays off on wide, one-hot heavy inputs; on narrow dense data lbfgs
+                # converges in fewer passes even at 100k+ rows. Accuracy is only reported to
+                # 2 decimals so a looser tol is enough.
+                solver = "saga" if n_features > LARGE_FEATURES else "lbfgs"
+                logs.append(f"Using '{solver}' solver ({X_train.shape[0]} samples, {n_features} features).")
+                model = LogisticRegression(C=float(C_val), solver=solver, tol=1e-3, random_state=42, max_iter=1000)
             elif model_step.type == "decision_tree_classifier":
                  max_depth_val = model_step.params.get("max_depth", None)
                  max_depth = int(max_depth_val) if max_depth_val else None
-                 model = DecisionTreeClassifier(max_depth=max_depth, random_state=42)
+                 # 'random' skips sorting every feature at every node; much faster on large data
+                 splitter = model_step.params.get("splitter", "best")
+                 model = DecisionTreeClassifier(max_depth=max_depth, splitter=splitter, random_state=42)
+            elif model_step.type == "hist_gradient_boosting":
+                 max_depth_val = model_step.params.get("max_depth", None)
+                 max_depth = int(max_depth_val) if max_depth_val else None
+                 # Features are binned to uint8 once; each split is then a histogram scan
+                 cat_idx = list(range(len(X_numeric), len(X_numeric) + len(X_categorical)))
+                 model = HistGradientBoostingClassifier(max_depth=max_depth, max_bins=255,
+                                                        categorical_features=cat_idx or None, random_state=42)
             
-            logs.append("Training model...")
-            model.fit(X_train, y_train)
+            model.fit(X_train_t, y_train)
+            pipe = Pipeline([("preprocess", preprocess), ("model", model)])
+            feature_names = pipe.named_steps["preprocess"].get_feature_names_out().tolist()
+            logs.append(f"Feature Columns (Post-Encoding): {feature_names}")
             
             logs.append("Evaluating...")
-            y_pred = model.predict(X_test)
+            X_test_t = preprocess.transform(X_test)
+            y_pred = model.predict(X_test_t)
             accuracy = accuracy_score(y_test, y_pred)
             
             metrics = {
                 "Accuracy": f"{round(accuracy * 100, 2)}%",
-                "train_samples": len(X_train),
-                "test_samples": len(X_test)
+                "train_samples": X_train.shape[0],
+                "test_samples": X_test.shape[0]
             }
             logs.append(f"Training completed. Accuracy: {accuracy:.4f}")
 
@@ -169,25 +250,37 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
 
             # === 2. Feature Importance ===
             try:
-                feature_names = X.columns.tolist()
                 raw_importance = []
                 
                 if hasattr(model, "feature_importances_"):
                     # Decision Tree
                     raw_importance = model.feature_importances_
                 elif hasattr(model, "coef_"):
-                    # Logistic Regression (Coef shape: [n_classes, n_features])
+                    # Logistic Regression (Coef shape: [n_classes, n_features], or [1, n_features] when binary)
                     # We take mean absolute importance across classes
-                    raw_importance = np.abs(model.coef_).mean(axis=0)
+                    coef = model.coef_
+                    if coef.shape[0] == 1:
+                        raw_importance = np.abs(coef[0])
+                    else:
+                        raw_importance = np.linalg.norm(coef, ord=1, axis=0)
+                        raw_importance /= coef.shape[0]
+                elif model_step.type == "hist_gradient_boosting":
+                    # HGB exposes no impurity importances; measure the accuracy drop when each
+                    # feature is shuffled on (at most 10k rows of) the held-out split instead.
+                    max_samples = min(1.0, PERMUTATION_MAX_SAMPLES / X_test_t.shape[0])
+                    perm = permutation_importance(model, X_test_t, y_test, n_repeats=5,
+                                                  max_samples=max_samples, random_state=42)
+                    raw_importance = np.clip(perm.importances_mean, 0.0, None)
                 
                 if len(raw_importance) > 0:
-                    # Zip and sort
+                    # Sort descending in numpy, then build the records in that order
+                    raw_importance = np.asarray(raw_importance, dtype=np.float64)
+                    order = np.argsort(-raw_importance, kind='stable')
+                    scores = raw_importance[order].tolist()
                     feat_imp = [
-                        {"feature": str(name), "importance": float(score)} 
-                        for name, score in zip(feature_names, raw_importance)
+                        {"feature": str(feature_names[i]), "importance": score}
+                        for i, score in zip(order.tolist(), scores)
                     ]
-                    # Sort descending
-                    feat_imp.sort(key=lambda x: x["importance"], reverse=True)
                     metrics["feature_importance"] = feat_imp
                     logs.append("Feature importance calculated.")
             except Exception as e:
@@ -197,7 +290,7 @@ def process_pipeline(pipeline: PipelineRequest) -> PipelineResult:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             saved_model_filename = f"model_{pipeline.datasetName}_{timestamp}.pkl"
             save_path = os.path.join(MODELS_DIR, saved_model_filename)
-            joblib.dump(model, save_path)
+            joblib.dump(pipe, save_path, compress=MODEL_COMPRESSION, protocol=5)
             logs.append(f"Model saved to {saved_model_filename}")
             
         else:
@@ -1,13 +1,23 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import pipeline
+from contextlib import asynccontextmanager
 import uvicorn
 import os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.pool = pipeline.new_process_pool()
+    yield
+    app.state.pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
+# Registered before CORS so the early 413 still gets CORS headers
+app.middleware("http")(pipeline.reject_oversized_uploads)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
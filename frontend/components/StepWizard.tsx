@@ -7,7 +7,7 @@ console.log("Using API_BASE:", API_BASE);
 
 // === Types ===
 type PreprocessingType = 'standard_scaler' | 'min_max_scaler' | 'drop_nulls';
-type ModelType = 'logistic_regression' | 'decision_tree_classifier';
+type ModelType = 'logistic_regression' | 'decision_tree_classifier' | 'hist_gradient_boosting';
 type StepType = PreprocessingType | 'train_test_split' | ModelType;
 
 interface PipelineStep {
@@ -26,13 +26,15 @@ interface PipelineResult {
 
 interface DatasetMetadata {
     filename: string;
-    rows: number;
+    rows: number | null;
     columns: number;
     column_names: string[];
     preview: Record<string, any>[];
     distributions?: { target_column: string; data: Record<string, number> };
     correlations?: { labels: string[]; data: number[][] };
     scatter_data?: { x: number; y: number; class: string }[];
+    dataset_id?: string;
+    stats_ready?: boolean;
 }
 
 // === Constants & Educational Content ===
@@ -70,9 +72,15 @@ const STEP_TEMPLATES: Record<StepType, { label: string; category: 'preprocessing
     decision_tree_classifier: {
         label: 'Decision Tree Classifier',
         category: 'model',
-        defaultParams: { max_depth: 5 },
+        defaultParams: { max_depth: 5, splitter: 'best' },
         description: "Builds a flowchart-like structure (e.g. 'If Petal > 2...') to make decisions. Good for capturing complex rules."
     },
+    hist_gradient_boosting: {
+        label: 'Histogram Gradient Boosting',
+        category: 'model',
+        defaultParams: { max_depth: 5 },
+        description: "Builds many small trees, each fixing the mistakes of the last. Groups values into buckets first, so it stays fast on very large datasets."
+    },
 };
 
 const WIZARD_STEPS = [
@@ -162,7 +170,9 @@ export default function StepWizard() {
                 const errorText = await res.text();
                 throw new Error(`Server error (${res.status}): ${errorText || res.statusText}`);
             }
-            setDatasetMetadata(await res.json());
+            const metadata: DatasetMetadata = await res.json();
+            setDatasetMetadata(metadata);
+            if (!metadata.stats_ready && metadata.dataset_id) pollDatasetStats(metadata.dataset_id);
         } catch (err: any) {
             console.error("Upload failed:", err);
             setUploadError(`Connection failed: ${err.message}. Check console for details.`);
@@ -170,6 +180,36 @@ export default function StepWizard() {
         } finally { setIsUploading(false); }
     };
 
+    // Large files return after the first chunk; row count and charts arrive from a background job
+    const pollDatasetStats = async (datasetId: string) => {
+        // Stop waiting on a failed (500) or forgotten (404) job and say why instead of spinning forever
+        const giveUp = (message: string) => {
+            setDatasetMetadata((prev) => prev && prev.dataset_id === datasetId ? { ...prev, stats_ready: true } : prev);
+            setUploadError(message);
+        };
+        for (let attempt = 0; attempt < 600; attempt++) {
+            await new Promise((resolve) => setTimeout(resolve, 1000));
+            try {
+                const res = await fetch(`${API_BASE}/api/upload/${datasetId}/viz`);
+                if (!res.ok) {
+                    const body = await res.json().catch(() => null);
+                    giveUp(`Dataset analysis failed (${res.status}): ${body?.detail || res.statusText}`);
+                    return;
+                }
+                const { ready, ...stats } = await res.json();
+                if (ready) {
+                    setDatasetMetadata((prev) => prev && prev.dataset_id === datasetId ? { ...prev, ...stats, stats_ready: true } : prev);
+                    return;
+                }
+            } catch (err: any) {
+                console.error("Stats polling failed:", err);
+                giveUp(`Dataset analysis failed: ${err.message}`);
+                return;
+            }
+        }
+        giveUp("Dataset analysis timed out. Charts and row count are unavailable.");
+    };
+
     const runPipeline = async () => {
         if (!selectedModel) return;
         setIsRunning(true);
@@ -221,9 +261,12 @@ export default function StepWizard() {
                                 </div>
 
                                 <div className="results-grid" style={{ marginBottom: '1rem', marginTop: '1rem' }}>
-                                    <div className="metric-card"><div className="metric-value">{datasetMetadata.rows}</div><div className="metric-label">Rows</div></div>
+                                    <div className="metric-card"><div className="metric-value">{datasetMetadata.rows ?? (datasetMetadata.stats_ready ? '—' : '…')}</div><div className="metric-label">Rows</div></div>
                                     <div className="metric-card"><div className="metric-value">{datasetMetadata.columns}</div><div className="metric-label">Columns</div></div>
                                 </div>
+                                {!datasetMetadata.stats_ready && (
+                                    <p style={{ fontSize: '0.8rem', color: 'var(--secondary)', marginBottom: '1rem' }}>⏳ Analyzing the full dataset for charts...</p>
+                                )}
 
                                 {/* Data Preview Table */}
                                 {datasetMetadata.preview && datasetMetadata.preview.length > 0 && (
@@ -377,7 +420,7 @@ export default function StepWizard() {
                     <div>
                         <h2>Model Selection</h2>
                         <div style={{ display: 'flex', gap: '1rem', marginBottom: '2rem' }}>
-                            {['logistic_regression', 'decision_tree_classifier'].map((modelType) => (
+                            {['logistic_regression', 'decision_tree_classifier', 'hist_gradient_boosting'].map((modelType) => (
                                 <div key={modelType} onClick={() => selectModel(modelType as ModelType)} style={{ flex: 1, padding: '1.5rem', border: `2px solid ${selectedModel?.type === modelType ? 'var(--primary)' : 'var(--border)'}`, borderRadius: '8px', cursor: 'pointer', background: selectedModel?.type === modelType ? 'rgba(0,0,0,0.02)' : 'transparent' }}>
                                     <h3 style={{ marginBottom: '0.5rem' }}>{STEP_TEMPLATES[modelType as StepType].label}</h3>
                                     <p style={{ fontSize: '0.8rem', color: 'var(--secondary)', lineHeight: '1.4' }}>{STEP_TEMPLATES[modelType as StepType].description}</p>